@@ -1,4 +1,3 @@
-import copy
 import os
 
 from fastapi import FastAPI
@@ -23,15 +22,23 @@ BASE_URL = os.getenv("TOOL_SERVER_BASE_URL", "http://localhost:8000")
 
 
 # --- Tool-Spezifikation für OpenWebUI ---
-@app.get("/toolspec")
-def get_toolspec():
-    spec = copy.deepcopy(scrub_spec)
+def _build_toolspec():
+    # Flache Kopie genügt: nur "endpoint"/"base_url" werden überschrieben.
+    spec = dict(scrub_spec)
     if not spec["endpoint"].startswith("http"):
         spec["endpoint"] = f"{BASE_URL}{spec['endpoint']}"
     spec.setdefault("base_url", BASE_URL)
     return {"tools": [spec]}
 
 
+TOOLSPEC = _build_toolspec()
+
+
+@app.get("/toolspec")
+def get_toolspec():
+    return TOOLSPEC
+
+
 @app.get("/")
 def root():
     return {"status": "Tool Server running", "toolspec": "/toolspec", "base_url": BASE_URL}
@@ -0,0 +1,30 @@
+from docx import Document
+
+from tools import scrub
+
+
+def _redact_docx_paragraph(text: str) -> str:
+    document = Document()
+    document.add_paragraph(text)
+    _, replacements = scrub._scrub_paragraphs(scrub._collect_document_text(document))
+    scrub._apply_replacements_to_document(document, replacements, preserve_formatting=True)
+    return document.paragraphs[0].text
+
+
+def test_email_with_non_ascii_local_part_is_redacted_in_text_and_docx():
+    text = "Mail an müller@firma.de bitte"
+    clean_text, _ = scrub._scrub_text(text)
+    assert "ller@firma.de" not in clean_text
+    assert _redact_docx_paragraph(text) == clean_text
+
+
+def test_entity_is_not_replaced_inside_other_words():
+    text = "Kai wohnt in Kaiserslautern. KaiXY"
+    clean_text, _ = scrub._scrub_text(text)
+    assert clean_text == "<PER_1> wohnt in Kaiserslautern. KaiXY"
+    assert _redact_docx_paragraph(text) == clean_text
+
+
+def test_entity_with_non_latin1_capital_is_redacted():
+    clean_text, _ = scrub._scrub_text("gruß an Łukasz")
+    assert clean_text == "gruß an <PER_1>"
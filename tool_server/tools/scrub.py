@@ -1,21 +1,83 @@
+import asyncio
 import base64
 import binascii
-from collections import OrderedDict
+import multiprocessing
+import os
+import queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import cache
 from io import BytesIO
-from typing import Iterable, List, Literal, Optional, Tuple
+from typing import Iterable, Iterator, List, Literal, Optional, Tuple, Union
 
-import re
+import ahocorasick
 import spacy
 from docx import Document
+from docx.table import Table, _Cell
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 
-router = APIRouter()
-nlp = spacy.load("de_core_news_sm")
+try:  # optional: google-re2 (DFA, kein Backtracking) für die Regex-Scans
+    import re2 as _re_engine
 
-EMAIL_PATTERN = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+    _ASCII_FLAG = None  # RE2 behandelt \b immer als ASCII-Wortgrenze
+except ImportError:
+    import re as _re_engine
+
+    _ASCII_FLAG = _re_engine.ASCII
+
+# Es werden nur doc.ents gelesen – alle übrigen Komponenten (auch parser/senter) bleiben aus.
+# Falls später Satzgrenzen nötig sind: nlp.enable_pipe("senter") statt den Parser zu aktivieren.
+# Geladen wird erst bei Bedarf, damit der Hauptprozess im Pool-Betrieb keine eigene Kopie hält.
+@cache
+def _get_nlp():
+    nlp = spacy.load("de_core_news_sm", enable=["tok2vec", "ner"])
+    # In den sm/md/lg-Pipelines hat ner einen eigenen internen tok2vec; der geteilte
+    # tok2vec würde dann nur umsonst rechnen und wird nur behalten, wenn ner ihm zuhört.
+    if "tok2vec" in nlp.pipe_names and "ner" not in getattr(nlp.get_pipe("tok2vec"), "listening_components", []):
+        nlp.disable_pipe("tok2vec")
+    return nlp
+
+
+NER_BATCH_SIZE = 64
+
+EMAIL_PATTERN = _re_engine.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b", _ASCII_FLAG)
 ENTITY_LABELS = ("PER", "ORG", "LOC")
 
+# Wiederverwendete Puffer für DOCX-Ausgaben; sehr große Puffer werden nicht aufbewahrt.
+DOCX_BUFFER_POOL_SIZE = 8
+DOCX_BUFFER_MAX_POOLED_BYTES = 16 * 1024 * 1024
+_docx_buffer_pool: "queue.Queue[BytesIO]" = queue.Queue(maxsize=DOCX_BUFFER_POOL_SIZE)
+
+# Optionaler Prozess-Pool für Regex/NER (0 = Threads); jeder Worker lädt sein eigenes Modell.
+SCRUB_WORKERS = int(os.getenv("TOOL_SERVER_SCRUB_WORKERS", "0"))
+_scrub_executor: Optional[ProcessPoolExecutor] = None
+
+
+@asynccontextmanager
+async def _scrub_executor_lifespan(_app):
+    global _scrub_executor
+    if SCRUB_WORKERS > 0:
+        _scrub_executor = _create_scrub_executor()
+        # Ein leerer Auftrag pro Worker startet alle Prozesse schon beim Hochfahren.
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(_scrub_executor, _scrub_paragraphs, []) for _ in range(SCRUB_WORKERS))
+        )
+    else:
+        await asyncio.to_thread(_get_nlp)
+    try:
+        yield
+    finally:
+        if _scrub_executor is not None:
+            _scrub_executor.shutdown(cancel_futures=True)
+            _scrub_executor = None
+
+
+router = APIRouter(lifespan=_scrub_executor_lifespan)
+
 
 class ScrubRequest(BaseModel):
     mode: Literal["text", "docx"] = "text"
@@ -33,103 +95,174 @@ class ScrubResponse(BaseModel):
 
 
 @router.post("/scrub", response_model=ScrubResponse)
-def scrub_text(item: ScrubRequest) -> ScrubResponse:
+async def scrub_text(item: ScrubRequest) -> ScrubResponse:
     warnings: List[str] = []
 
     if item.mode == "text":
         if not item.text:
             raise HTTPException(status_code=400, detail="Field 'text' is required for mode='text'.")
-        clean_text, _ = _scrub_text(item.text)
+        clean_text, _ = await _run_scrub(_scrub_text, item.text)
         return ScrubResponse(clean_text=clean_text, warnings=warnings)
 
     if not item.docx_base64:
         raise HTTPException(status_code=400, detail="Field 'docx_base64' is required for mode='docx'.")
 
     try:
-        doc_bytes = base64.b64decode(item.docx_base64)
+        doc_bytes = await asyncio.to_thread(base64.b64decode, item.docx_base64)
     except (binascii.Error, ValueError) as exc:
         raise HTTPException(status_code=400, detail="Field 'docx_base64' must be valid base64.") from exc
 
-    original_doc = Document(BytesIO(doc_bytes))
-    plain_text = _collect_document_text(original_doc)
-    clean_text, replacements = _scrub_text(plain_text)
+    document = await asyncio.to_thread(Document, BytesIO(doc_bytes))
+    del doc_bytes
+    paragraphs = await asyncio.to_thread(_collect_document_text, document)
+    clean_paragraphs, replacements = await _run_scrub(_scrub_paragraphs, paragraphs)
+    clean_text = "\n".join(clean_paragraphs)
 
     clean_docx_base64: Optional[str] = None
     if item.return_docx:
-        redacted_doc = Document(BytesIO(doc_bytes))
-        warnings.extend(_apply_replacements_to_document(redacted_doc, replacements, item.preserve_formatting))
-        buffer = BytesIO()
-        redacted_doc.save(buffer)
-        clean_docx_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        warnings.extend(
+            await asyncio.to_thread(
+                _apply_replacements_to_document, document, replacements, item.preserve_formatting
+            )
+        )
+        clean_docx_base64 = await asyncio.to_thread(_save_docx_base64, document)
 
     response_text = clean_text if item.include_clean_text else None
     return ScrubResponse(clean_text=response_text, clean_docx_base64=clean_docx_base64, warnings=warnings)
 
 
+def _create_scrub_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=SCRUB_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_scrub_worker,
+    )
+
+
+async def _run_scrub(func, *args):
+    global _scrub_executor
+    executor = _scrub_executor
+    if executor is None:
+        return await asyncio.to_thread(func, *args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # Ein abgestürzter Worker macht den ganzen Pool unbrauchbar: einmal neu aufbauen
+        # (nur der erste betroffene Request tut das) und den Auftrag wiederholen.
+        if _scrub_executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            _scrub_executor = _create_scrub_executor()
+    try:
+        return await loop.run_in_executor(_scrub_executor, func, *args)
+    except BrokenProcessPool as exc:
+        raise HTTPException(status_code=503, detail="Scrub worker crashed; please retry.") from exc
+
+
+def _init_scrub_worker() -> None:
+    # Lädt das Modell im Worker und wärmt es mit einem Probelauf an.
+    _get_nlp()("Warmlauf")
+
+
+def _acquire_docx_buffer() -> BytesIO:
+    try:
+        buffer = _docx_buffer_pool.get_nowait()
+    except queue.Empty:
+        return BytesIO()
+    # Nicht truncate(): das würde den reservierten Speicher wieder freigeben.
+    buffer.seek(0)
+    return buffer
+
+
+def _release_docx_buffer(buffer: BytesIO) -> None:
+    with buffer.getbuffer() as view:
+        if view.nbytes > DOCX_BUFFER_MAX_POOLED_BYTES:
+            return
+    try:
+        _docx_buffer_pool.put_nowait(buffer)
+    except queue.Full:
+        pass
+
+
+def _save_docx_base64(document: Document) -> str:
+    buffer = _acquire_docx_buffer()
+    document.save(buffer)
+    docx_size = buffer.tell()
+    with buffer.getbuffer() as docx_view:
+        encoded = base64.b64encode(docx_view[:docx_size]).decode("ascii")
+    _release_docx_buffer(buffer)
+    return encoded
+
+
 def _scrub_text(text: str) -> Tuple[str, List[Tuple[str, str]]]:
-    segments: List[Tuple[int, int, str, str]] = []
-    placeholder_map: OrderedDict[str, str] = OrderedDict()
+    cleaned, replacements = _scrub_paragraphs([text])
+    return cleaned[0], replacements
+
 
+def _scrub_paragraphs(paragraphs: List[str]) -> Tuple[List[str], List[Tuple[str, str]]]:
+    placeholder_map: dict[str, str] = {}
     email_counter = 0
-    for match in EMAIL_PATTERN.finditer(text):
+    label_counters = {label: 0 for label in ENTITY_LABELS}
+
+    def _email_placeholder(match) -> str:
+        nonlocal email_counter
         raw = match.group(0)
         if raw not in placeholder_map:
             email_counter += 1
             placeholder_map[raw] = f"<EMAIL_{email_counter}>"
-        segments.append((match.start(), match.end(), placeholder_map[raw], raw))
+        return placeholder_map[raw]
 
-    label_counters = {label: 0 for label in ENTITY_LABELS}
-    doc = nlp(text)
-    for ent in doc.ents:
-        if ent.label_ not in ENTITY_LABELS:
-            continue
-        raw = text[ent.start_char:ent.end_char]
-        if raw not in placeholder_map:
-            label_counters[ent.label_] += 1
-            placeholder_map[raw] = f"<{ent.label_}_{label_counters[ent.label_]}>"
-        segments.append((ent.start_char, ent.end_char, placeholder_map[raw], raw))
+    # Identische Absätze (z. B. verbundene Tabellenzellen) nur einmal scannen.
+    unique_paragraphs = list(dict.fromkeys(paragraphs))
+    without_emails = {text: EMAIL_PATTERN.sub(_email_placeholder, text) for text in unique_paragraphs}
 
-    segments.sort(key=lambda item: (item[0], -(item[1] - item[0])))
+    # NER läuft auf dem Originaltext, damit die Offsets stimmen.
+    entity_replacements: List[Tuple[str, str]] = []
+    ner_candidates = [text for text in unique_paragraphs if _has_uppercase(text)]
+    for text, entities in zip(ner_candidates, _iter_entities(ner_candidates)):
+        for start, end, label in entities:
+            raw = text[start:end]
+            if raw not in placeholder_map:
+                label_counters[label] += 1
+                placeholder_map[raw] = f"<{label}_{label_counters[label]}>"
+                entity_replacements.append((raw, placeholder_map[raw]))
 
-    cleaned_parts: List[str] = []
-    last_index = 0
-    ordered_replacements: List[Tuple[str, str]] = []
-    seen: set[str] = set()
+    automaton = _build_replacement_automaton(entity_replacements)
+    cleaned_by_text = {text: _apply_replacements(value, automaton) for text, value in without_emails.items()}
+    return [cleaned_by_text[text] for text in paragraphs], list(placeholder_map.items())
+
+
+def _has_uppercase(text: str) -> bool:
+    # PER/ORG/LOC sind großgeschrieben; Absätze ohne Großbuchstaben brauchen kein NER.
+    # Vergleich mit lower() erfasst alle Unicode-Großbuchstaben (Ł, Š, Кирилл, …).
+    return text != text.lower()
 
-    for start, end, placeholder, raw in segments:
-        if start < last_index:
-            continue
-        cleaned_parts.append(text[last_index:start])
-        cleaned_parts.append(placeholder)
-        if raw not in seen:
-            ordered_replacements.append((raw, placeholder))
-            seen.add(raw)
-        last_index = end
 
-    cleaned_parts.append(text[last_index:])
-    return "".join(cleaned_parts), ordered_replacements
+def _iter_entities(texts: Iterable[str]) -> Iterator[List[Tuple[int, int, str]]]:
+    for doc in _get_nlp().pipe(texts, batch_size=NER_BATCH_SIZE):
+        yield [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents if ent.label_ in ENTITY_LABELS]
 
 
-def _collect_document_text(document: Document) -> str:
+def _collect_document_text(document: Document) -> List[str]:
     chunks: List[str] = []
     for paragraph in document.paragraphs:
         if paragraph.text:
             chunks.append(paragraph.text)
-    for table in document.tables:
-        chunks.extend(_collect_table_text(table))
-    return "\n".join(chunks)
+    for cell in _iter_table_cells(document.tables):
+        chunks.extend(paragraph.text for paragraph in cell.paragraphs if paragraph.text)
+    return chunks
 
 
-def _collect_table_text(table) -> List[str]:
-    chunks: List[str] = []
-    for row in table.rows:
-        for cell in row.cells:
-            for paragraph in cell.paragraphs:
-                if paragraph.text:
-                    chunks.append(paragraph.text)
-            for nested in cell.tables:
-                chunks.extend(_collect_table_text(nested))
-    return chunks
+def _iter_table_cells(tables: Iterable[Table]) -> Iterator[_Cell]:
+    # Explizite Tiefensuche statt Rekursion; Reihenfolge wie im Dokument.
+    stack: deque[Union[Table, _Cell]] = deque(reversed(list(tables)))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Table):
+            stack.extend(reversed([cell for row in node.rows for cell in row.cells]))
+        else:
+            yield node
+            stack.extend(reversed(node.tables))
 
 
 def _apply_replacements_to_document(
@@ -137,38 +270,34 @@ def _apply_replacements_to_document(
     replacements: List[Tuple[str, str]],
     preserve_formatting: bool,
 ) -> List[str]:
-    ordered_replacements = sorted(replacements, key=lambda pair: len(pair[0]), reverse=True)
+    automaton = _build_replacement_automaton(replacements)
     warnings: List[str] = []
-    warnings.extend(_replace_in_paragraph_sequence(document.paragraphs, ordered_replacements, preserve_formatting))
-    for table in document.tables:
-        warnings.extend(_replace_in_table(table, ordered_replacements, preserve_formatting))
+    warnings.extend(_replace_in_paragraph_sequence(document.paragraphs, automaton, preserve_formatting))
+    for cell in _iter_table_cells(document.tables):
+        warnings.extend(_replace_in_paragraph_sequence(cell.paragraphs, automaton, preserve_formatting))
     return warnings
 
 
-def _replace_in_table(table, replacements: List[Tuple[str, str]], preserve_formatting: bool) -> List[str]:
-    warnings: List[str] = []
-    for row in table.rows:
-        for cell in row.cells:
-            warnings.extend(_replace_in_paragraph_sequence(cell.paragraphs, replacements, preserve_formatting))
-            for nested in cell.tables:
-                warnings.extend(_replace_in_table(nested, replacements, preserve_formatting))
-    return warnings
-
-
-def _replace_in_paragraph_sequence(paragraphs, replacements: List[Tuple[str, str]], preserve_formatting: bool) -> List[str]:
+def _replace_in_paragraph_sequence(paragraphs, automaton: ahocorasick.Automaton, preserve_formatting: bool) -> List[str]:
     warnings: List[str] = []
     for paragraph in paragraphs:
-        warnings.extend(_replace_in_paragraph(paragraph, replacements, preserve_formatting))
+        warnings.extend(_replace_in_paragraph(paragraph, automaton, preserve_formatting))
     return warnings
 
 
-def _replace_in_paragraph(paragraph, replacements: List[Tuple[str, str]], preserve_formatting: bool) -> List[str]:
+def _replace_in_paragraph(paragraph, automaton: ahocorasick.Automaton, preserve_formatting: bool) -> List[str]:
     warnings: List[str] = []
-    desired_text = _apply_replacements(paragraph.text, replacements)
+    current_text = paragraph.text
+    desired_text = _apply_replacements(current_text, automaton)
 
     if preserve_formatting:
+        if desired_text == current_text:
+            return warnings
         for run in paragraph.runs:
-            run.text = _apply_replacements(run.text, replacements)
+            run_text = run.text
+            redacted_text = _apply_replacements(run_text, automaton)
+            if redacted_text != run_text:
+                run.text = redacted_text
         if paragraph.text != desired_text:
             _rewrite_paragraph(paragraph, desired_text)
             warnings.append("Absatz musste für vollständige Redaktion neu gesetzt werden.")
@@ -178,18 +307,61 @@ def _replace_in_paragraph(paragraph, replacements: List[Tuple[str, str]], preser
     return warnings
 
 
-def _apply_replacements(value: str, replacements: Iterable[Tuple[str, str]]) -> str:
-    result = value
+def _build_replacement_automaton(replacements: Iterable[Tuple[str, str]]) -> ahocorasick.Automaton:
+    automaton = ahocorasick.Automaton()
     for original, redacted in replacements:
-        result = result.replace(original, redacted)
-    return result
+        # E-Mails mit derselben (ASCII-)Wortgrenze prüfen wie EMAIL_PATTERN, sonst fällt
+        # z. B. "ller@firma.de" in "müller@firma.de" wieder heraus.
+        ascii_boundary = redacted.startswith("<EMAIL_")
+        automaton.add_word(original, (len(original), redacted, ascii_boundary))
+    automaton.make_automaton()
+    return automaton
+
+
+def _apply_replacements(value: str, automaton: ahocorasick.Automaton) -> str:
+    if automaton.kind != ahocorasick.AHOCORASICK:
+        return value
+
+    hits: List[Tuple[int, int, str]] = []
+    for last_char, (length, redacted, ascii_boundary) in automaton.iter(value):
+        start, end = last_char - length + 1, last_char + 1
+        # Nur ganze Wörter ersetzen: "Kai" nicht in "Kaiserslautern".
+        if _is_word_char(value, start - 1, ascii_boundary) or _is_word_char(value, end, ascii_boundary):
+            continue
+        hits.append((start, end, redacted))
+    if not hits:
+        return value
+    hits.sort(key=lambda item: (item[0], -(item[1] - item[0])))
+
+    parts: List[str] = []
+    last_index = 0
+    for start, end, redacted in hits:
+        if start < last_index:
+            continue
+        parts.append(value[last_index:start])
+        parts.append(redacted)
+        last_index = end
+
+    parts.append(value[last_index:])
+    return "".join(parts)
+
+
+def _is_word_char(value: str, index: int, ascii_only: bool = False) -> bool:
+    if index < 0 or index >= len(value):
+        return False
+    char = value[index]
+    if ascii_only and not char.isascii():
+        return False
+    return char.isalnum() or char == "_"
 
 
 def _rewrite_paragraph(paragraph, text: str) -> None:
-    while paragraph.runs:
-        paragraph.runs[0]._element.getparent().remove(paragraph.runs[0]._element)
+    # Direkt auf den <w:r>-Elementen arbeiten, ohne Run-Wrapper pro Lauf.
+    p_element = paragraph._p
+    for r_element in p_element.r_lst:
+        p_element.remove(r_element)
     if text:
-        paragraph.add_run(text)
+        p_element.add_r().text = text
 
 
 tool_spec = {